@@ -1,200 +1,292 @@
 import os
 import time
-import base64
-import subprocess
 import json
+import orjson
 import datetime
 import sys
 import logging
+import logging.handlers
+import queue
+import atexit
+import threading
+import concurrent.futures
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 import io
+import pymupdf
 from google.cloud import vision
+from google.api_core import retry, exceptions
 
 # Configure logging with timestamps
 def setup_logging():
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s.%(msecs)03d %(message)s',
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(
+        fmt='%(asctime)s.%(msecs)03d %(message)s',
         datefmt='%Y-%m-%d %H:%M:%S'
-    )
+    ))
+    
+    # OCR worker threads only enqueue records; a single listener thread writes them out
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    listener.start()
+    atexit.register(listener.stop)
+    
+    # Timestamps are added by the listener's handler, so only merge the message here
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.setFormatter(logging.Formatter('%(message)s'))
+    logging.basicConfig(level=logging.INFO, handlers=[queue_handler])
     return logging.getLogger('pdf_watcher')
 
+# Page rasterization settings (good balance of quality and speed)
+RENDER_DPI = 200
+JPEG_QUALITY = 90
+
+# Maximum number of Vision API requests in flight at once
+MAX_CONCURRENCY = 8
+
+# Maximum number of images Vision accepts in a single batch_annotate_images request
+VISION_BATCH_SIZE = 16
+
+# Image bytes per batch request, kept under Vision's ~10 MB request payload limit
+VISION_BATCH_MAX_BYTES = 8 * 1024 * 1024
+
+# Exponential backoff for rate-limited or transiently unavailable Vision API calls
+VISION_RETRY = retry.Retry(
+    predicate=retry.if_exception_type(
+        exceptions.ResourceExhausted,
+        exceptions.ServiceUnavailable,
+        exceptions.DeadlineExceeded,
+    ),
+    initial=1.0,
+    maximum=16.0,
+    multiplier=2.0,
+    deadline=120.0,
+)
+
+# Timeout for a single batch_annotate_images attempt; VISION_RETRY handles retries
+VISION_CALL_TIMEOUT = 60.0
+
+# Names of detected symbol breaks, keyed by enum value
+_BREAK_NAMES = {
+    break_type.value: break_type.name
+    for break_type in vision.TextAnnotation.DetectedBreak.BreakType
+}
+
+# Quiet period after the last file event before processing starts
+DEBOUNCE_SECONDS = 0.5
+
+# watchdog only emits close-write events through its inotify backend
+CLOSE_EVENTS_SUPPORTED = sys.platform.startswith('linux')
+
+# File size stability polling. With inotify the poll mostly covers files moved into the
+# watch directory, which never get a close event, so keep a stable period long enough to
+# ride out a writer pausing mid-file; the short period is only for the polling fallback
+STABLE_CHECK_INTERVAL = 0.2
+STABLE_PERIOD = 2.0 if CLOSE_EVENTS_SUPPORTED else 0.5
+
 # Create logger instance
 logger = setup_logging()
 
-# Override print to use our logger
-def print(*args, **kwargs):
-    logger.info(' '.join(map(str, args)), **kwargs)
-
 class PDFHandler(FileSystemEventHandler):
     def __init__(self):
         self.watch_dir = "/images"
         self.input_file = os.path.join(self.watch_dir, "input.pdf")
+        # One client for the process lifetime so every PDF reuses the same gRPC channel
+        self.vision_client = vision.ImageAnnotatorClient()
+        self._processing_lock = threading.Lock()
+        self._timer_lock = threading.Lock()
+        self._debounce_timer = None
+        self._last_processed_version = None
+        self._rerun_requested = False
+        self._stopped = False
+        # Set when the writer closes input.pdf, which ends an in-flight stability poll early
+        self._write_closed = threading.Event()
         
     def on_created(self, event):
+        # Poll the file size until it stops changing. With inotify, a close event from the
+        # writer replaces this run if it is still pending, or ends its poll (see on_closed);
+        # a file moved in from outside the watch directory only produces this event, so it
+        # must be handled here too
+        if not event.is_directory and event.src_path == self.input_file:
+            self._write_closed.clear()
+            self._schedule_processing(wait_for_stable=True)
+    
+    def on_modified(self, event):
+        if not CLOSE_EVENTS_SUPPORTED and not event.is_directory and event.src_path == self.input_file:
+            self._schedule_processing(wait_for_stable=True)
+    
+    def on_moved(self, event):
+        if event.is_directory:
+            return
+        if event.src_path == self.input_file:
+            self._last_processed_version = None
+        # A rename inside the watch directory (e.g. input.pdf.part -> input.pdf) is atomic,
+        # so the file is complete as soon as it appears under its final name
+        if event.dest_path == self.input_file:
+            self._schedule_processing(wait_for_stable=False)
+    
+    def on_deleted(self, event):
+        # Forget the processed version so the same file dropped in again is reprocessed
+        if not event.is_directory and event.src_path == self.input_file:
+            self._last_processed_version = None
+    
+    def on_closed(self, event):
+        # Only emitted on Linux, when a file opened for writing is closed (IN_CLOSE_WRITE)
         if not event.is_directory and event.src_path == self.input_file:
-            # Small delay to ensure the file is ready for processing
-            time.sleep(1)
-            self.process_pdf()
+            self._write_closed.set()
+            self._schedule_processing(wait_for_stable=False)
+    
+    def _schedule_processing(self, wait_for_stable):
+        """Coalesce a burst of file events into a single processing run."""
+        with self._timer_lock:
+            if self._stopped:
+                return
+            if self._debounce_timer is not None:
+                self._debounce_timer.cancel()
+            self._debounce_timer = threading.Timer(
+                DEBOUNCE_SECONDS, self._run_processing, args=(wait_for_stable,)
+            )
+            self._debounce_timer.start()
+    
+    def stop(self):
+        """Cancel any pending run and wait for an active one to finish writing its output."""
+        with self._timer_lock:
+            self._stopped = True
+            if self._debounce_timer is not None:
+                self._debounce_timer.cancel()
+        with self._processing_lock:
+            pass
+    
+    def _run_processing(self, wait_for_stable):
+        """Process input.pdf unless a run is already active or this version was already processed."""
+        if not self._processing_lock.acquire(blocking=False):
+            # Remember the event so the active run re-checks input.pdf when it finishes
+            self._rerun_requested = True
+            logger.info("⏭️ Processing already in progress, will re-check input.pdf afterwards")
+            return
+        try:
+            if self._stopped:
+                return
+            self._rerun_requested = False
+            version = self._file_version()
+            if version is None:
+                logger.info("❌ File disappeared: %s", self.input_file)
+                return
+            if version == self._last_processed_version:
+                logger.info("⏭️ input.pdf unchanged since last run, ignoring event")
+                return
+            self._last_processed_version = version
+            self.process_pdf(wait_for_stable=wait_for_stable)
+        finally:
+            self._processing_lock.release()
+        
+        # Pick up a new upload that arrived while the run was active
+        if self._rerun_requested or self._input_changed():
+            self._schedule_processing(wait_for_stable=True)
+    
+    def _input_changed(self):
+        """Check whether input.pdf was replaced or modified since the version last processed."""
+        version = self._file_version()
+        return version is not None and version != self._last_processed_version
+    
+    def _file_version(self):
+        """Identify the current input.pdf by inode, mtime and size, or None if it is missing."""
+        try:
+            st = os.stat(self.input_file)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
     
-    def is_file_stable(self, file_path, check_interval=1.0, stable_period=2.0):
+    def is_file_stable(self, file_path, check_interval=STABLE_CHECK_INTERVAL, stable_period=STABLE_PERIOD):
         """Check if file size remains constant for the specified period."""
-        print(f"🔍 Monitoring file size stability for {stable_period} seconds...")
+        logger.info("🔍 Monitoring file size stability for %s seconds...", stable_period)
         last_size = -1
         stable_start = None
+        # The poll ticks several times a second, so only log the first empty-file observation
+        # and at most one size change per second
+        zero_size_logged = False
+        last_logged_size = -1
+        last_log_time = 0.0
         
         while True:
+            # Give up on shutdown so stop() does not wait on a file that never settles
+            if self._stopped:
+                logger.info("🛑 Shutting down, abandoning file stability check")
+                return False
+            
             try:
                 current_size = os.path.getsize(file_path)
                 current_time = time.time()
                 
+                # The writer closed the file, so it is complete without waiting any longer
+                if self._write_closed.is_set():
+                    logger.info("✅ Writer closed the file at %s bytes", current_size)
+                    return True
+                
                 if current_size == 0:
-                    print("⚠️ File size is 0, waiting for content...")
+                    if not zero_size_logged:
+                        logger.info("⚠️ File size is 0, waiting for content...")
+                        zero_size_logged = True
                     time.sleep(check_interval)
                     continue
                     
                 if current_size != last_size:
-                    print(f"📊 File size changed: {last_size} → {current_size} bytes")
+                    if current_time - last_log_time >= 1.0:
+                        logger.info("📊 File size changed: %s → %s bytes", last_logged_size, current_size)
+                        last_logged_size = current_size
+                        last_log_time = current_time
                     last_size = current_size
                     stable_start = current_time
                 elif stable_start and (current_time - stable_start) >= stable_period:
-                    print(f"✅ File size stable at {current_size} bytes for {stable_period} seconds")
+                    logger.info("✅ File size stable at %s bytes for %s seconds", current_size, stable_period)
                     return True
                     
             except FileNotFoundError:
-                print(f"❌ File disappeared: {file_path}")
+                logger.info("❌ File disappeared: %s", file_path)
                 return False
                 
             time.sleep(check_interval)
     
-    def process_pdf(self):
+    def process_pdf(self, wait_for_stable=True):
         start_time = datetime.datetime.now()
-        print(f"🖨️ Found input.pdf. Processing... [Started at: {start_time.strftime('%H:%M:%S')}]")
+        logger.info("🖨️ Found input.pdf. Processing... [Started at: %s]", start_time.strftime('%H:%M:%S'))
         try:
-            # Wait for the file to be completely written
-            stability_start = datetime.datetime.now()
-            if not self.is_file_stable(self.input_file):
-                print("❌ File is not stable or was removed during check")
-                return
-            stability_end = datetime.datetime.now()
-            stability_duration = (stability_end - stability_start).total_seconds()
-            print(f"⏱️ File stability check took {stability_duration:.2f} seconds")
+            # Wait for the file to be completely written, unless the writer is known to be done
+            if wait_for_stable:
+                stability_start = datetime.datetime.now()
+                if not self.is_file_stable(self.input_file):
+                    logger.info("❌ File is not stable or was removed during check")
+                    return
+                stability_end = datetime.datetime.now()
+                stability_duration = (stability_end - stability_start).total_seconds()
+                logger.info("⏱️ File stability check took %.2f seconds", stability_duration)
                 
             file_size = os.path.getsize(self.input_file)
-            print(f"📄 Final file size: {file_size} bytes")
+            logger.info("📄 Final file size: %s bytes", file_size)
+            # Record the version actually processed, which may be newer than when the run started
+            self._last_processed_version = self._file_version()
             
-            # First, try a simple PDF info command to check if the file is valid
-            print("🔍 Checking PDF file...")
-            pdf_info_start = datetime.datetime.now()
+            # Open the PDF in-process; this also validates that the file is a readable PDF
             try:
-                check_cmd = ["pdfinfo", self.input_file]
-                check_result = subprocess.run(
-                    check_cmd,
-                    capture_output=True,
-                    text=True,
-                    timeout=10
-                )
-                print(f"📄 PDF Info:\n{check_result.stdout}")
+                doc = pymupdf.open(self.input_file)
             except Exception as e:
-                print(f"⚠️ PDF info check failed: {e}")
-            pdf_info_end = datetime.datetime.now()
-            pdf_info_duration = (pdf_info_end - pdf_info_start).total_seconds()
-            print(f"⏱️ PDF info check took {pdf_info_duration:.2f} seconds")
-
-            # Convert PDF to JPG using ImageMagick
-            conversion_start = datetime.datetime.now()
-            print(f"🚀 Starting PDF to JPG conversion at: {conversion_start.strftime('%H:%M:%S')}")
-            cmd = [
-                "timeout", "600",  # 10 minute timeout for full document
-                "convert",
-                "-density", "200",  # Good balance of quality and speed
-                "-quality", "90",
-                self.input_file,
-                os.path.join(self.watch_dir, "output-%d.jpg")
-            ]
-            print(f"🚀 Running command: {' '.join(cmd)}")
+                logger.info("❌ Failed to open PDF: %s", e)
+                return
             
-            try:
-                result = subprocess.run(
-                    cmd, 
-                    check=False, 
-                    capture_output=True, 
-                    text=True,
-                    timeout=610  # Slightly more than the command timeout
-                )
-                
-                conversion_end = datetime.datetime.now()
-                conversion_duration = (conversion_end - conversion_start).total_seconds()
-                print(f"⏱️ PDF to JPG conversion took {conversion_duration:.2f} seconds")
-                
-                if result.returncode == 124:  # 124 is the exit code for timeout
-                    print("❌ PDF conversion timed out")
-                    return
-                elif result.returncode != 0:
-                    print(f"❌ Command failed with code {result.returncode}")
-                    if result.stderr:
-                        print(f"STDERR: {result.stderr.strip()}")
-                    return
-                
-                print("✅ PDF to JPG conversion completed")
-                
-                # Find all output-*.jpg files
-                jpg_files = sorted([
-                    f for f in os.listdir(self.watch_dir)
-                    if f.startswith('output-') and f.endswith('.jpg')
-                ])
-                
-                if not jpg_files:
-                    print("❌ No output JPG files found")
-                    return
-                    
-                print(f"✅ Converted to {len(jpg_files)} image files")
-                
-                # Convert JPG to base64 and save to files
-                base64_start = datetime.datetime.now()
-                print(f"🔄 Starting JPG to base64 conversion at: {base64_start.strftime('%H:%M:%S')}")
+            with doc:
+                logger.info("📄 PDF has %s pages", doc.page_count)
+                if os.environ.get('PDF_WATCHER_DEBUG'):
+                    logger.info("📄 PDF metadata: %s", doc.metadata)
                 
-                for jpg_file in jpg_files:
-                    jpg_path = os.path.join(self.watch_dir, jpg_file)
-                    file_stat = os.stat(jpg_path)
-                    file_size = file_stat.st_size
-                    file_mtime = time.ctime(file_stat.st_mtime)
-                    
-                    # Convert to base64
-                    b64_content = self.jpg_to_base64(jpg_path)
-                    b64_file = jpg_file.replace('.jpg', '.b64')
-                    b64_path = os.path.join(self.watch_dir, b64_file)
-                    
-                    with open(b64_path, 'w') as f:
-                        f.write(b64_content)
-                        
-                    print(f"  - {jpg_file} (Size: {file_size} bytes, Modified: {file_mtime})")
-                    print(f"  Base64 saved to: {b64_file} (Length: {len(b64_content)} characters)")
-                
-                base64_end = datetime.datetime.now()
-                base64_duration = (base64_end - base64_start).total_seconds()
-                print(f"⏱️ JPG to base64 conversion took {base64_duration:.2f} seconds for {len(jpg_files)} files")
-                print(f"✅ Created {len(jpg_files)} individual base64 files")
-                
-                # Extract text from all base64 files
-
-                # Extract text from all output-*.b64 files and save to extracted_text.txt
-                self.extract_text_from_b64_images()
-
-            except subprocess.TimeoutExpired:
-                print("❌ PDF conversion timed out (subprocess timeout)")
-                return
-            except Exception as e:
-                print(f"❌ Error during PDF conversion: {str(e)}")
-                return
+                # Render pages and extract text from them, saving to extracted_text.txt
+                self.extract_text_from_pdf(doc)
                 
         except Exception as e:
-            print(f"❌ An error occurred: {e}")
+            logger.info("❌ An error occurred: %s", e)
         finally:
             end_time = datetime.datetime.now()
             total_duration = (end_time - start_time).total_seconds()
-            print(f"⏱️ Total processing time: {total_duration:.2f} seconds [Completed at: {end_time.strftime('%H:%M:%S')}]")
+            logger.info("⏱️ Total processing time: %.2f seconds [Completed at: %s]", total_duration, end_time.strftime('%H:%M:%S'))
             
             # Save overall timing to a file
             try:
@@ -207,150 +299,86 @@ class PDFHandler(FileSystemEventHandler):
                         'pdf_path': self.input_file,
                         'pdf_size_bytes': os.path.getsize(self.input_file) if os.path.exists(self.input_file) else None
                     }, timing_file, indent=2)
-                print(f"✅ Overall timing information saved to {timing_summary_path}")
+                logger.info("✅ Overall timing information saved to %s", timing_summary_path)
             except Exception as e:
-                print(f"⚠️ Failed to save timing information: {e}")
+                logger.info("⚠️ Failed to save timing information: %s", e)
     
-    @staticmethod
-    def jpg_to_base64(image_path):
-        with open(image_path, "rb") as img_file:
-            return base64.b64encode(img_file.read()).decode("utf-8")
-
-    def extract_text_from_b64_images(self):
+    def extract_text_from_pdf(self, doc):
         """
-        Extract text from all output-*.b64 files in the watch directory using Google Cloud Vision API
-        and save the combined text to extracted_text.txt.
+        Render each page of the open PDF document to JPEG bytes with PyMuPDF, extract text
+        from them using Google Cloud Vision API and save the combined text to extracted_text.txt.
         
         Also extracts detailed information including text blocks, paragraphs, words,
         and their bounding boxes, saving this structured data to a JSON file.
         """
         extraction_start = datetime.datetime.now()
-        print(f"🔍 Starting text extraction at: {extraction_start.strftime('%H:%M:%S')}")
+        logger.info("🔍 Starting text extraction at: %s", extraction_start.strftime('%H:%M:%S'))
         
-        b64_files = sorted([
-            f for f in os.listdir(self.watch_dir)
-            if f.startswith('output-') and f.endswith('.b64')
-        ])
-        if not b64_files:
-            print("❌ No .b64 files found for OCR.")
+        if doc.page_count == 0:
+            logger.info("❌ No pages found for OCR.")
             return
             
-        client = vision.ImageAnnotatorClient()
         all_text = []
         all_structured_data = []
         page_timings = []
+        rendering_duration = 0.0
         
-        for b64_file in b64_files:
-            page_start = datetime.datetime.now()
-            b64_path = os.path.join(self.watch_dir, b64_file)
-            page_num = int(b64_file.split('-')[1].split('.')[0])  # Extract page number from filename
-            
-            with open(b64_path, 'r') as f:
-                b64_content = f.read()
+        # Render pages in-process and hand each full batch to the pool as soon as it is
+        # ready, so rendering overlaps with in-flight Vision requests; the pool size
+        # caps in-flight Vision requests
+        results = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_CONCURRENCY) as executor:
+            pending = set()
             
-            # Track API call time specifically
-            api_call_start = datetime.datetime.now()
-            image = vision.Image(content=base64.b64decode(b64_content))
+            def submit_batch(batch):
+                nonlocal pending
+                # Backpressure: stop rendering while the pool already has a full set of
+                # batches, so rendered page images don't pile up in the executor queue
+                if len(pending) >= MAX_CONCURRENCY:
+                    done, pending = concurrent.futures.wait(
+                        pending, return_when=concurrent.futures.FIRST_COMPLETED
+                    )
+                    for future in done:
+                        results.extend(future.result())
+                pending.add(executor.submit(self._ocr_batch, batch))
             
-            # Use document_text_detection for more structured results
-            # This is better for multi-column text and documents
-            response = client.document_text_detection(image=image)
-            api_call_end = datetime.datetime.now()
-            api_call_duration = (api_call_end - api_call_start).total_seconds()
-            
-            if response.error.message:
-                print(f"❌ Vision API error for {b64_file}: {response.error.message}")
-                continue
+            batch = []
+            batch_bytes = 0
+            for page_num, page in enumerate(doc):
+                render_start = datetime.datetime.now()
+                image_bytes = self._render_page(page)
+                rendering_duration += (datetime.datetime.now() - render_start).total_seconds()
                 
-            # Get the full text
-            full_text = response.full_text_annotation.text if response.full_text_annotation else ''
-            
-            # Extract structured data
-            page_data = {
-                'page_number': page_num,
-                'full_text': full_text,
-                'blocks': []
-            }
-            
-            # Process each page
-            for page in response.full_text_annotation.pages:
-                # Process each block (typically paragraphs or sections)
-                for block_idx, block in enumerate(page.blocks):
-                    block_data = {
-                        'block_id': block_idx,
-                        'confidence': block.confidence,
-                        'bounding_box': self._get_bounding_box(block.bounding_box),
-                        'paragraphs': []
-                    }
-                    
-                    # Process each paragraph within the block
-                    for para_idx, paragraph in enumerate(block.paragraphs):
-                        para_text = ''
-                        para_data = {
-                            'paragraph_id': para_idx,
-                            'confidence': paragraph.confidence,
-                            'bounding_box': self._get_bounding_box(paragraph.bounding_box),
-                            'words': []
-                        }
-                        
-                        # Process each word within the paragraph
-                        for word_idx, word in enumerate(paragraph.words):
-                            word_text = ''.join([symbol.text for symbol in word.symbols])
-                            para_text += word_text + ' '
-                            
-                            # Get word details
-                            word_data = {
-                                'word_id': word_idx,
-                                'text': word_text,
-                                'confidence': word.confidence,
-                                'bounding_box': self._get_bounding_box(word.bounding_box),
-                                'symbols': []
-                            }
-                            
-                            # Get symbol details (characters)
-                            for symbol in word.symbols:
-                                symbol_data = {
-                                    'text': symbol.text,
-                                    'confidence': symbol.confidence
-                                }
-                                
-                                # Check for special properties
-                                if symbol.property.detected_break.type != 0:  # If there's a break
-                                    break_type = vision.TextAnnotation.DetectedBreak.BreakType(symbol.property.detected_break.type).name
-                                    symbol_data['break_type'] = break_type
-                                    
-                                word_data['symbols'].append(symbol_data)
-                                
-                            para_data['words'].append(word_data)
-                            
-                        para_data['text'] = para_text.strip()
-                        block_data['paragraphs'].append(para_data)
-                        
-                    page_data['blocks'].append(block_data)
-            
-            page_end = datetime.datetime.now()
-            page_duration = (page_end - page_start).total_seconds()
-            
-            # Record timing information
-            page_timing = {
-                'page': page_num,
-                'file': b64_file,
-                'total_time': page_duration,
-                'api_call_time': api_call_duration,
-                'text_length': len(full_text)
-            }
-            page_timings.append(page_timing)
-            
-            print(f"✅ Extracted text from {b64_file}: {len(full_text)} characters (API: {api_call_duration:.2f}s, Total: {page_duration:.2f}s)")
+                # Send the current batch first if this page would push it over the payload budget
+                if batch and batch_bytes + len(image_bytes) > VISION_BATCH_MAX_BYTES:
+                    submit_batch(batch)
+                    batch = []
+                    batch_bytes = 0
+                
+                batch.append((page_num, image_bytes))
+                batch_bytes += len(image_bytes)
+                if len(batch) == VISION_BATCH_SIZE:
+                    submit_batch(batch)
+                    batch = []
+                    batch_bytes = 0
+            if batch:
+                submit_batch(batch)
             
+            logger.info("⏱️ PDF page rendering took %.2f seconds for %s pages", rendering_duration, doc.page_count)
+            for future in concurrent.futures.as_completed(pending):
+                results.extend(future.result())
+        
+        # Keep pages in page-number order regardless of completion order
+        for page_num, full_text, page_data, page_timing in sorted(results, key=lambda r: r[0]):
             all_text.append(full_text)
             all_structured_data.append(page_data)
+            page_timings.append(page_timing)
         
         # Calculate average times
         if page_timings:
             avg_total_time = sum(timing['total_time'] for timing in page_timings) / len(page_timings)
             avg_api_time = sum(timing['api_call_time'] for timing in page_timings) / len(page_timings)
-            print(f"📊 Average processing time per page: {avg_total_time:.2f}s (API calls: {avg_api_time:.2f}s)")
+            logger.info("📊 Average processing time per page: %.2fs (API calls: %.2fs)", avg_total_time, avg_api_time)
         
         # Save timing information
         timing_path = os.path.join(self.watch_dir, 'extraction_timing.json')
@@ -366,64 +394,223 @@ class PDFHandler(FileSystemEventHandler):
         # Save the plain text
         text_save_start = datetime.datetime.now()
         output_path = os.path.join(self.watch_dir, 'extracted_text.txt')
-        with open(output_path, 'w') as out_file:
-            out_file.write('\n\n'.join(all_text))
+        # Write page by page through a large buffer rather than joining the whole document first
+        with open(output_path, 'w', buffering=1 << 20) as out_file:
+            for i, text in enumerate(all_text):
+                if i:
+                    out_file.write('\n\n')
+                out_file.write(text)
         
         # Save the structured data as JSON
         structured_output_path = os.path.join(self.watch_dir, 'extracted_structured_text.json')
-        with open(structured_output_path, 'w') as json_file:
-            json.dump(all_structured_data, json_file, indent=2)
+        # orjson serializes the nested page data into a single buffer in one write
+        with open(structured_output_path, 'wb') as json_file:
+            json_file.write(orjson.dumps(all_structured_data, option=orjson.OPT_INDENT_2))
         
         extraction_end = datetime.datetime.now()
         extraction_duration = (extraction_end - extraction_start).total_seconds()
         file_save_duration = (extraction_end - text_save_start).total_seconds()
         
-        print(f"⏱️ Total text extraction took {extraction_duration:.2f} seconds for {len(b64_files)} pages")
-        print(f"⏱️ File saving took {file_save_duration:.2f} seconds")
-        print(f"✅ All extracted text saved to {output_path}")
-        print(f"✅ Structured text data saved to {structured_output_path}")
-        print(f"✅ Timing information saved to {timing_path}")
+        logger.info("⏱️ Total text extraction took %.2f seconds for %s pages", extraction_duration, doc.page_count)
+        logger.info("⏱️ File saving took %.2f seconds", file_save_duration)
+        logger.info("✅ All extracted text saved to %s", output_path)
+        logger.info("✅ Structured text data saved to %s", structured_output_path)
+        logger.info("✅ Timing information saved to %s", timing_path)
         
-    def _get_bounding_box(self, bounding_box):
+    @staticmethod
+    def _render_page(page):
+        """
+        Rasterize a PDF page to JPEG bytes.
+        """
+        pix = page.get_pixmap(dpi=RENDER_DPI)
+        return pix.tobytes("jpeg", jpg_quality=JPEG_QUALITY)
+        
+    def _ocr_batch(self, pages):
+        """
+        Run OCR on a batch of rendered pages with a single batch_annotate_images request.
+        
+        Takes a list of (page_num, image_bytes) tuples and returns a list of
+        (page_num, full_text, page_data, page_timing) tuples for the pages that were
+        processed successfully.
+        """
+        # Use document_text_detection for more structured results
+        # This is better for multi-column text and documents
+        feature = vision.Feature(type_=vision.Feature.Type.DOCUMENT_TEXT_DETECTION)
+        # Vision accepts raw image bytes, so no base64 encoding is needed
+        requests = [
+            vision.AnnotateImageRequest(
+                image=vision.Image(content=image_bytes),
+                features=[feature]
+            )
+            for _, image_bytes in pages
+        ]
+        page_label = f"pages {pages[0][0]}-{pages[-1][0]}"
+        
+        # Track API call time specifically
+        api_call_start = datetime.datetime.now()
+        try:
+            batch_response = VISION_RETRY(self._batch_annotate)(self.vision_client, requests)
+        except (exceptions.GoogleAPICallError, exceptions.RetryError) as e:
+            logger.info("❌ Vision API call failed for %s: %s", page_label, e)
+            return []
+        api_call_end = datetime.datetime.now()
+        # Attribute an equal share of the batch call to each page
+        api_call_duration = (api_call_end - api_call_start).total_seconds() / len(pages)
+        
+        results = []
+        for (page_num, _), response in zip(pages, batch_response.responses):
+            result = self._parse_page_response(page_num, response, api_call_duration)
+            if result is not None:
+                results.append(result)
+        return results
+        
+    def _parse_page_response(self, page_num, response, api_call_duration):
         """
-        Helper method to convert Vision API bounding box to a dictionary.
+        Convert a single page's AnnotateImageResponse into text and structured data.
+        
+        Returns a (page_num, full_text, page_data, page_timing) tuple, or None if
+        the Vision API reported an error for the page.
         """
-        return {
-            'vertices': [
-                {'x': vertex.x, 'y': vertex.y}
-                for vertex in bounding_box.vertices
-            ]
+        page_start = datetime.datetime.now()
+        
+        if response.error.message:
+            logger.info("❌ Vision API error for page %s: %s", page_num, response.error.message)
+            return None
+            
+        # Get the full text
+        full_text = response.full_text_annotation.text if response.full_text_annotation else ''
+        
+        # Extract structured data as parallel column lists per level (one row per element).
+        # Rows link to their parent through the parent's row index within the page.
+        blocks = {'confidence': [], 'bounding_box': []}
+        paragraphs = {'block_id': [], 'text': [], 'confidence': [], 'bounding_box': []}
+        words = {'paragraph_id': [], 'text': [], 'confidence': [], 'bounding_box': []}
+        symbols = {'word_id': [], 'text': [], 'confidence': [], 'break_type': []}
+        page_data = {
+            'page_number': page_num,
+            'full_text': full_text,
+            'blocks': blocks,
+            'paragraphs': paragraphs,
+            'words': words,
+            'symbols': symbols
+        }
+        
+        # Process each page
+        for page in response.full_text_annotation.pages:
+            # Process each block (typically paragraphs or sections)
+            for block in page.blocks:
+                block_id = len(blocks['confidence'])
+                blocks['confidence'].append(block.confidence)
+                blocks['bounding_box'].append(self._get_bounding_box(block.bounding_box))
+                
+                # Process each paragraph within the block
+                for paragraph in block.paragraphs:
+                    paragraph_id = len(paragraphs['confidence'])
+                    para_text = ''
+                    
+                    # Process each word within the paragraph
+                    for word in paragraph.words:
+                        word_id = len(words['confidence'])
+                        word_chars = []
+                        
+                        # Get symbol details (characters) and build the word text in the same pass
+                        for symbol in word.symbols:
+                            symbol_text = symbol.text
+                            word_chars.append(symbol_text)
+                            symbols['word_id'].append(word_id)
+                            symbols['text'].append(symbol_text)
+                            symbols['confidence'].append(symbol.confidence)
+                            
+                            # Check for special properties
+                            break_type = symbol.property.detected_break.type
+                            symbols['break_type'].append(_BREAK_NAMES.get(break_type) if break_type else None)
+                        
+                        word_text = ''.join(word_chars)
+                        para_text += word_text + ' '
+                        
+                        # Get word details
+                        words['paragraph_id'].append(paragraph_id)
+                        words['text'].append(word_text)
+                        words['confidence'].append(word.confidence)
+                        words['bounding_box'].append(self._get_bounding_box(word.bounding_box))
+                    
+                    paragraphs['block_id'].append(block_id)
+                    paragraphs['text'].append(para_text.strip())
+                    paragraphs['confidence'].append(paragraph.confidence)
+                    paragraphs['bounding_box'].append(self._get_bounding_box(paragraph.bounding_box))
+        
+        page_end = datetime.datetime.now()
+        page_duration = (page_end - page_start).total_seconds() + api_call_duration
+        
+        # Record timing information
+        page_timing = {
+            'page': page_num,
+            'total_time': page_duration,
+            'api_call_time': api_call_duration,
+            'text_length': len(full_text)
         }
+        
+        logger.info("✅ Extracted text from page %s: %s characters (API: %.2fs, Total: %.2fs)", page_num, len(full_text), api_call_duration, page_duration)
+        
+        return page_num, full_text, page_data, page_timing
+        
+    @staticmethod
+    def _batch_annotate(client, requests):
+        """
+        Call batch_annotate_images, raising ResourceExhausted when any response
+        carries a rate-limit or quota error so that VISION_RETRY tries again.
+        """
+        # Disable the client's built-in retry so VISION_RETRY is the only retry policy
+        batch_response = client.batch_annotate_images(
+            requests=requests, retry=None, timeout=VISION_CALL_TIMEOUT
+        )
+        for response in batch_response.responses:
+            error_message = response.error.message
+            if error_message and ('rate limit' in error_message.lower() or 'quota' in error_message.lower()):
+                raise exceptions.ResourceExhausted(error_message)
+        return batch_response
+        
+    def _get_bounding_box(self, bounding_box):
+        """
+        Helper method to flatten a Vision API bounding box into [x0, y0, x1, y1, ...].
+        """
+        coords = []
+        for vertex in bounding_box.vertices:
+            coords.append(vertex.x)
+            coords.append(vertex.y)
+        return coords
 from dotenv import load_dotenv
 load_dotenv()
 def main():
     # Print startup banner with timestamp
-    print("📝 PDF Watcher starting up")
-    print(f"🔧 Python version: {sys.version}")
-    print(f"🔧 Watch directory: {os.getcwd()}")
+    logger.info("📝 PDF Watcher starting up")
+    logger.info("🔧 Python version: %s", sys.version)
+    logger.info("🔧 Watch directory: %s", os.getcwd())
     
     event_handler = PDFHandler()
     observer = Observer()
     
     try:
-        print(f"👀 Setting up observer for directory: {event_handler.watch_dir}")
+        logger.info("👀 Setting up observer for directory: %s", event_handler.watch_dir)
         observer.schedule(event_handler, event_handler.watch_dir, recursive=False)
         observer.start()
-        print("✅ Observer started successfully")
-        print("🔄 Ready to process PDF files")
-        print("ℹ️  Press Ctrl+C to stop")
+        logger.info("✅ Observer started successfully")
+        logger.info("🔄 Ready to process PDF files")
+        logger.info("ℹ️  Press Ctrl+C to stop")
         
-        while True:
-            time.sleep(1)
+        # Block until the observer thread exits instead of waking up every second
+        observer.join()
     except KeyboardInterrupt:
-        print("🛑 Received keyboard interrupt, shutting down...")
+        logger.info("🛑 Received keyboard interrupt, shutting down...")
         observer.stop()
     except Exception as e:
-        print(f"❌ Error in observer: {str(e)}")
+        logger.info("❌ Error in observer: %s", str(e))
     
-    print("🔄 Stopping observer...")
+    logger.info("🔄 Stopping observer...")
     observer.join()
-    print("✅ Observer stopped, exiting program")
+    logger.info("⏳ Waiting for any in-progress processing to finish...")
+    event_handler.stop()
+    logger.info("✅ Observer stopped, exiting program")
 
 if __name__ == "__main__":
     main()